@@ -9,23 +9,117 @@ With --output FILE, results are written to a JSON task file instead of stdout,
 enabling file-based async task delegation patterns.
 """
 
-import argparse
-import json
+from __future__ import annotations
+
+import errno
+import functools
 import os
-import subprocess
+import signal
 import sys
-import tempfile
-import time
 
+# Annotation-only imports; TYPE_CHECKING is spelled out rather than taken
+# from typing so that module stays off the startup path too.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import argparse
+    from collections.abc import Iterator
+
+# argparse and re are only needed once there are options to parse, json,
+# tempfile and time only for --output, and mmap and stat only for
+# --plan-file; they are imported where used, keeping startup of the common
+# direct invocation minimal.
+
+
+def _utcnow_iso() -> str:
+    """Return the current UTC time as an ISO 8601 string, e.g. 2025-01-01T00:00:00Z."""
+    import time
+
+    t = time.gmtime()
+    return (
+        f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}"
+        f"T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
+    )
+
+
+def _open_anonymous_tmp(dir_name: str) -> int | None:
+    """Open an unnamed O_TMPFILE inode in dir_name, or None if unsupported."""
+    if not hasattr(os, "O_TMPFILE"):
+        return None
+    try:
+        return os.open(
+            dir_name, os.O_TMPFILE | os.O_WRONLY | os.O_DSYNC, 0o600
+        )
+    except OSError:
+        # Filesystem or kernel without O_TMPFILE support
+        return None
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    """Write all of data to fd, retrying on short writes."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _link_anonymous_tmp(fd: int, dir_name: str) -> str | None:
+    """Give an O_TMPFILE inode a tmp name in dir_name, or None on failure."""
+    tmp_name = f"tmp{os.urandom(4).hex()}.tmp"
+    try:
+        dir_fd = os.open(dir_name, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return None
+    try:
+        # Passing dst_dir_fd makes os.link use linkat(AT_SYMLINK_FOLLOW),
+        # which resolves the /proc magic link to the inode itself.
+        os.link(f"/proc/self/fd/{fd}", tmp_name, dst_dir_fd=dir_fd)
+    except OSError:
+        return None
+    finally:
+        os.close(dir_fd)
+    return os.path.join(dir_name, tmp_name)
+
+
+def atomic_write_bytes(
+    path: str, payload: bytes, dir_name: str | None = None
+) -> None:
+    """Write payload to path atomically via tmp file + rename.
+
+    Where O_TMPFILE is available the data is written with O_DSYNC to an
+    anonymous inode that only gets a directory entry once complete, so an
+    interrupted write leaves no stray tmp file behind. Otherwise the tmp
+    file is fsync'ed before the rename. Callers writing the same file
+    repeatedly can pass its dir_name to avoid re-resolving it.
+    """
+    if dir_name is None:
+        dir_name = os.path.dirname(os.path.abspath(path))
+
+    fd = _open_anonymous_tmp(dir_name)
+    if fd is not None:
+        try:
+            _write_all(fd, payload)
+            # linkat cannot overwrite, so link under a tmp name and rename
+            # over the target, exactly like the mkstemp path below.
+            tmp_path = _link_anonymous_tmp(fd, dir_name)
+        finally:
+            os.close(fd)
+        if tmp_path is not None:
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+            return
+
+    import tempfile
 
-def atomic_write_json(path: str, data: dict) -> None:
-    """Write JSON to path atomically via tmp file + rename."""
-    dir_name = os.path.dirname(os.path.abspath(path))
     fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
     try:
-        with os.fdopen(fd, "w") as f:
-            json.dump(data, f, indent=2)
-            f.write("\n")
+        try:
+            _write_all(fd, payload)
+            # mkstemp cannot open with O_DSYNC, so sync explicitly
+            os.fsync(fd)
+        finally:
+            os.close(fd)
         os.replace(tmp_path, path)
     except BaseException:
         # Clean up tmp file on any failure
@@ -36,79 +130,184 @@ def atomic_write_json(path: str, data: dict) -> None:
         raise
 
 
+@functools.cache
+def _load_orjson():
+    """Import the optional orjson module once; None when not installed.
+
+    Failed imports are not cached by Python, so without the memo every
+    task file write would search sys.path again.
+    """
+    try:
+        import orjson
+    except ImportError:  # optional, falls back to the stdlib json encoder
+        return None
+    return orjson
+
+
+def atomic_write_json(
+    path: str, data: dict, dir_name: str | None = None
+) -> None:
+    """Write data to path atomically as indented JSON.
+
+    Uses orjson when it is installed, which is notably faster for large
+    Claude Code outputs, and the stdlib encoder otherwise. The stdlib
+    fallback keeps ensure_ascii so strings that are not valid UTF-8 (e.g.
+    surrogate-escaped paths) are still encodable.
+    """
+    payload = None
+    orjson = _load_orjson()
+    if orjson is not None:
+        try:
+            payload = orjson.dumps(
+                data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+            )
+        except orjson.JSONEncodeError:
+            # orjson rejects lone surrogates; json escapes them instead
+            pass
+    if payload is None:
+        import json
+
+        payload = (json.dumps(data, indent=2) + "\n").encode()
+    atomic_write_bytes(path, payload, dir_name)
+
+
+@functools.cache
 def is_third_party_configured() -> bool:
-    """Check if third-party model is configured via environment variables."""
+    """Check if third-party model is configured via environment variables.
+
+    The environment does not change during a run, so the result is cached.
+    """
     return bool(
         os.environ.get("ANTHROPIC_BASE_URL") or os.environ.get("ANTHROPIC_API_KEY")
     )
 
 
-def build_command(args: argparse.Namespace) -> list[str]:
-    """Build the claude CLI command from parsed arguments."""
-    cmd = ["claude", "-p"]
+def _claude_name() -> str:
+    """Return the claude executable to run, honouring a CLAUDE_BIN override."""
+    return os.environ.get("CLAUDE_BIN") or "claude"
 
-    # Session management: explicit create vs resume
-    if args.resume:
-        cmd += ["--resume", args.resume]
-    elif args.session:
-        cmd += ["--session-id", args.session]
 
-    if args.continue_session:
-        cmd.append("--continue")
+def resolve_claude_bin() -> str | None:
+    """Locate the claude executable, or None if it is not installed.
 
-    # Permission control (mutually exclusive group handled by argparse)
-    if args.dangerously_skip_permissions:
-        cmd.append("--dangerously-skip-permissions")
-    elif args.permission_mode:
-        cmd += ["--permission-mode", args.permission_mode]
+    PATH is searched once here so the spawn itself needs no lookup.
+    """
+    import shutil
 
-    # --allowedTools and --disallowedTools are variadic (<tools...>) in the
-    # Claude CLI, meaning they greedily consume all subsequent non-flag args.
-    # Passing tools as separate args would cause the prompt (the last positional
-    # arg) to be swallowed.  Pass the comma-separated string as a single value
-    # instead — the CLI explicitly accepts "Comma or space-separated" input.
-    if args.allowed_tools:
-        cmd += ["--allowedTools", args.allowed_tools]
+    return shutil.which(_claude_name())
 
-    if args.disallowed_tools:
-        cmd += ["--disallowedTools", args.disallowed_tools]
 
-    # Model selection (skip if third-party model is configured via env vars)
-    if args.model and not is_third_party_configured():
-        cmd += ["--model", args.model]
+# --timeout default, shared with the bare-prompt fast path in main()
+_DEFAULT_TIMEOUT = 600
+# signal.alarm takes a C int, which also keeps setitimer in range
+_MAX_TIMEOUT = 2**31 - 1
 
+# Plain CLI flags as (argparse dest, claude flag, takes a value). Options in
+# the same mutually exclusive argparse group (--resume/--session,
+# --dangerously-skip-permissions/--permission-mode) are never both set.
+_FLAG_MAP = (
+    # Session management: explicit create vs resume
+    ("resume", "--resume", True),
+    ("session", "--session-id", True),
+    ("continue_session", "--continue", False),
+    # Permission control
+    ("dangerously_skip_permissions", "--dangerously-skip-permissions", False),
+    ("permission_mode", "--permission-mode", True),
+    # --allowedTools and --disallowedTools are variadic (<tools...>) in the
+    # Claude CLI, meaning they greedily consume all subsequent non-flag args.
+    # Passing tools as separate args would cause the prompt (the last
+    # positional arg) to be swallowed.  Pass the comma-separated string as a
+    # single value instead — the CLI explicitly accepts "Comma or
+    # space-separated" input.
+    ("allowed_tools", "--allowedTools", True),
+    ("disallowed_tools", "--disallowedTools", True),
     # Execution limits
-    if args.max_turns:
-        cmd += ["--max-turns", str(args.max_turns)]
-    if args.max_budget:
-        cmd += ["--max-budget-usd", str(args.max_budget)]
-
+    ("max_turns", "--max-turns", True),
+    ("max_budget", "--max-budget-usd", True),
     # Output format
-    if args.output_format:
-        cmd += ["--output-format", args.output_format]
-
+    ("output_format", "--output-format", True),
     # System prompt injection
-    if args.append_system_prompt:
-        cmd += ["--append-system-prompt", args.append_system_prompt]
+    ("append_system_prompt", "--append-system-prompt", True),
+    # MCP configuration
+    ("mcp_config", "--mcp-config", True),
+)
+
+
+def _iter_flags(args: argparse.Namespace) -> Iterator[str]:
+    """Yield the claude CLI option tokens for parsed arguments."""
+    for name, flag, takes_value in _FLAG_MAP:
+        value = getattr(args, name, None)
+        if not value:
+            continue
+        yield flag
+        if takes_value:
+            yield str(value)
+
+    # Model selection (skip if third-party model is configured via env vars)
+    if args.model and not is_third_party_configured():
+        yield "--model"
+        yield args.model
 
     # --add-dir is variadic (<directories...>); split and pass individually.
-    # The prompt is protected by the -- separator below.
+    # The prompt is protected by the -- separator in build_command.
     if args.add_dir:
-        for d in args.add_dir.split(","):
-            cmd += ["--add-dir", d.strip()]
+        import re
+
+        # Split on commas and strip surrounding whitespace in one pass; re
+        # caches the compiled pattern, and is only imported when needed.
+        for d in re.split(r"\s*,\s*", args.add_dir.strip()):
+            yield "--add-dir"
+            yield d
 
-    # MCP configuration
-    if args.mcp_config:
-        cmd += ["--mcp-config", args.mcp_config]
 
+def build_command(args: argparse.Namespace) -> list[str]:
+    """Build the claude CLI command from parsed arguments."""
     # Use -- to end option parsing, ensuring the prompt is never consumed
     # by variadic options like --allowedTools, --disallowedTools, or --add-dir.
-    cmd.append("--")
-    cmd.append(args.prompt)
-    return cmd
+    return ["claude", "-p", *_iter_flags(args), "--", args.prompt]
 
 
-def main() -> None:
+def _read_plan_file(path: str) -> str:
+    """Read a UTF-8 plan file, memory-mapping regular files.
+
+    Line endings are normalized to \\n, as text-mode open() would do.
+    """
+    import mmap
+    import stat
+
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+            # Pipes (e.g. /dev/stdin) cannot be mapped; empty files need not be
+            text = f.read().decode("utf-8")
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                text = str(m, "utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _timeout_seconds(value: str) -> int:
+    """argparse type for --timeout: a positive integer signal.alarm accepts."""
+    import argparse
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if not 0 < number <= _MAX_TIMEOUT:
+        raise argparse.ArgumentTypeError(
+            f"must be an integer between 1 and {_MAX_TIMEOUT}: {value!r}"
+        )
+    return number
+
+
+@functools.cache
+def _build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser for the claude_exec CLI."""
+    import argparse
+
     parser = argparse.ArgumentParser(
         description="Run Claude Code in non-interactive print mode",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -229,9 +428,9 @@ examples:
     # Process control
     parser.add_argument(
         "--timeout",
-        type=int,
-        default=600,
-        help="Subprocess timeout in seconds (default: 600)",
+        type=_timeout_seconds,
+        default=_DEFAULT_TIMEOUT,
+        help="Subprocess timeout in seconds (default: %(default)s)",
     )
 
     # Task file output
@@ -248,20 +447,30 @@ examples:
         help="Read execution plan from file instead of command line argument",
     )
 
+    return parser
+
+
+def main() -> None:
+    if len(sys.argv) == 2 and sys.argv[1] and not sys.argv[1].startswith("-"):
+        # Fast path for the common bare-prompt call: with no options the
+        # command is fixed, so skip argparse and build_command entirely.
+        cmd = ["claude", "-p", "--", sys.argv[1]]
+        _run_direct(cmd, _DEFAULT_TIMEOUT)
+
+    parser = _build_parser()
     args = parser.parse_args()
 
     # Resolve prompt from --plan-file if provided
     if args.plan_file:
         try:
-            with open(args.plan_file) as f:
-                args.prompt = f.read()
+            args.prompt = _read_plan_file(args.plan_file)
         except FileNotFoundError:
             print(
                 f"ERROR: Plan file not found: {args.plan_file}",
                 file=sys.stderr,
             )
             sys.exit(1)
-        except OSError as e:
+        except (OSError, UnicodeDecodeError) as e:
             print(
                 f"ERROR: Cannot read plan file: {e}",
                 file=sys.stderr,
@@ -274,98 +483,218 @@ examples:
     cmd = build_command(args)
 
     if args.output:
-        _run_with_output_file(cmd, args)
+        _run_with_output_file(cmd, args, resolve_claude_bin())
     else:
-        _run_direct(cmd, args)
+        _run_direct(cmd, args.timeout)
+
+
+# Signals Python ignores at startup; like subprocess's restore_signals,
+# reset them to SIG_DFL so Claude Code and its tools see normal behavior.
+_RESET_SIGNALS = (signal.SIGPIPE, signal.SIGXFSZ)
+
 
+def _run_direct(cmd: list[str], timeout: int) -> None:
+    """Replace this process with Claude Code (used when --output is not set).
 
-def _run_direct(cmd: list[str], args: argparse.Namespace) -> None:
-    """Original behavior: run Claude Code and pipe stdout/stderr directly."""
+    stdout/stderr are inherited and no Python parent lingers for the
+    duration of the run. The --timeout is enforced with an alarm that
+    survives the exec, so the kernel terminates Claude Code via SIGALRM.
+    execvp does the PATH lookup itself, so a missing claude is detected
+    from its ENOENT without a separate shutil.which pass.
+    """
+    claude = _claude_name()
+    for sig in _RESET_SIGNALS:
+        signal.signal(sig, signal.SIG_DFL)
+    signal.alarm(timeout)
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=args.timeout,
-        )
-    except subprocess.TimeoutExpired:
-        print(
-            f"ERROR: Claude Code did not respond within {args.timeout}s. "
-            "Consider increasing --timeout for complex tasks.",
-            file=sys.stderr,
-        )
-        sys.exit(124)
-    except FileNotFoundError:
-        print(
-            "ERROR: 'claude' command not found. "
-            "Install Claude Code CLI: npm install -g @anthropic-ai/claude-code",
-            file=sys.stderr,
-        )
-        sys.exit(127)
+        os.execvp(claude, cmd)
+    except OSError as e:
+        # Not on PATH or a missing interpreter (ENOENT), no shebang (ENOEXEC)
+        signal.alarm(0)
+        if e.errno == errno.ENOENT:
+            print(
+                "ERROR: 'claude' command not found. "
+                "Install Claude Code CLI: npm install -g @anthropic-ai/claude-code",
+                file=sys.stderr,
+            )
+            sys.exit(127)
+        print(f"ERROR: Cannot execute {claude}: {e.strerror}", file=sys.stderr)
+        sys.exit(126)
+
+
+def _spawn_and_wait(
+    claude_bin: str,
+    cmd: list[str],
+    stdout_fd: int,
+    stderr_fd: int,
+    timeout: int,
+) -> int | None:
+    """Run cmd with redirected output; return its exit code, None on timeout.
+
+    The child is started with posix_spawn and waited on directly, with a
+    SIGALRM interval timer killing it once the timeout expires.
+    """
+    pid = os.posix_spawn(
+        claude_bin,
+        cmd,
+        os.environ,
+        file_actions=[
+            (os.POSIX_SPAWN_DUP2, stdout_fd, 1),
+            (os.POSIX_SPAWN_DUP2, stderr_fd, 2),
+        ],
+        setsigdef=_RESET_SIGNALS,
+    )
+    timed_out = False
+
+    def kill_child() -> None:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def on_alarm(signum, frame):
+        nonlocal timed_out
+        timed_out = True
+        kill_child()
+
+    try:
+        previous = signal.signal(signal.SIGALRM, on_alarm)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            # waitpid is retried automatically after the handler runs (PEP 475)
+            _, wait_status = os.waitpid(pid, 0)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    except BaseException:
+        # Never leave Claude Code running unsupervised
+        kill_child()
+        raise
+
+    if timed_out:
+        return None
+    return os.waitstatus_to_exitcode(wait_status)
 
-    if result.stdout:
-        print(result.stdout, end="")
-    if result.stderr:
-        print(result.stderr, end="", file=sys.stderr)
 
-    sys.exit(result.returncode)
+# Phase-1 status is written before Claude Code starts, so it is formatted
+# from a template rather than run through the JSON encoder.
+_RUNNING_TPL = (
+    b'{"status":"running","started_at":"%s","pid":%d,"output_file":%s%s}\n'
+)
 
 
-def _run_with_output_file(cmd: list[str], args: argparse.Namespace) -> None:
-    """Write results to a JSON task file. stdout only emits the file path."""
+def _run_with_output_file(
+    cmd: list[str], args: argparse.Namespace, claude_bin: str | None
+) -> None:
+    """Write results to a JSON task file. stdout only emits the file path.
+
+    Claude Code's stdout is streamed straight into a sibling
+    <output>.stdout file, whose path the task file records as output_file.
+    """
+    import json
+    import tempfile
+
     output_path = os.path.abspath(args.output)
+    output_dir = os.path.dirname(output_path)
+    stdout_path = output_path + ".stdout"
     session_id = args.resume or args.session or None
 
-    # Phase 1: write "running" status immediately
-    running_status = {
-        "status": "running",
-        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-        "pid": os.getpid(),
-    }
-    if session_id:
-        running_status["session_id"] = session_id
-    atomic_write_json(output_path, running_status)
-
-    # Phase 2: execute Claude Code synchronously
-    try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=args.timeout,
-        )
-    except subprocess.TimeoutExpired:
-        atomic_write_json(output_path, {
-            "status": "timeout",
-            "error": f"Claude Code did not respond within {args.timeout}s",
-            "exit_code": 124,
-            "completed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-        })
-        print(output_path)
-        sys.exit(124)
-    except FileNotFoundError:
+    if claude_bin is None:
         atomic_write_json(output_path, {
             "status": "error",
             "error": "'claude' command not found",
             "exit_code": 127,
-            "completed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-        })
+            "completed_at": _utcnow_iso(),
+        }, dir_name=output_dir)
         print(output_path)
         sys.exit(127)
 
+    # Open output_file before announcing "running", so a failure here is
+    # reported in the task file rather than leaving it stuck at running.
+    # The name is predictable (often in /tmp), so never follow a symlink.
+    try:
+        stdout_fd = os.open(
+            stdout_path,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW,
+            0o600,
+        )
+    except OSError as e:
+        atomic_write_json(output_path, {
+            "status": "error",
+            "error": f"Cannot open {stdout_path}: {e.strerror}",
+            "exit_code": 1,
+            "completed_at": _utcnow_iso(),
+        }, dir_name=output_dir)
+        print(output_path)
+        sys.exit(1)
+
+    # Phase 1: write "running" status immediately
+    session_frag = b""
+    if session_id:
+        session_frag = b',"session_id":' + json.dumps(session_id).encode()
+    running_status = _RUNNING_TPL % (
+        _utcnow_iso().encode(),
+        os.getpid(),
+        json.dumps(stdout_path).encode(),
+        session_frag,
+    )
+    atomic_write_bytes(output_path, running_status, output_dir)
+
+    # Phase 2: execute Claude Code synchronously. stdout goes straight to
+    # output_file, so it can be tailed while running and is never held in
+    # memory; stderr is spooled to a temporary file for the "error" field.
+    with tempfile.TemporaryFile() as stderr_tmp:
+        try:
+            returncode = _spawn_and_wait(
+                claude_bin, cmd, stdout_fd, stderr_tmp.fileno(), args.timeout
+            )
+        except OSError as e:
+            # e.g. a missing interpreter (ENOENT) or no shebang (ENOEXEC)
+            if e.errno == errno.ENOENT:
+                exit_code, error = 127, "'claude' command not found"
+            else:
+                exit_code, error = 126, f"Cannot execute {claude_bin}: {e.strerror}"
+            atomic_write_json(output_path, {
+                "status": "error",
+                "error": error,
+                "exit_code": exit_code,
+                "completed_at": _utcnow_iso(),
+            }, dir_name=output_dir)
+            print(output_path)
+            sys.exit(exit_code)
+        finally:
+            os.close(stdout_fd)
+
+        if returncode is None:
+            atomic_write_json(output_path, {
+                "status": "timeout",
+                "output_file": stdout_path,
+                "error": f"Claude Code did not respond within {args.timeout}s",
+                "exit_code": 124,
+                "completed_at": _utcnow_iso(),
+            }, dir_name=output_dir)
+            print(output_path)
+            sys.exit(124)
+
+        # stdout stays raw bytes in output_file; only stderr is decoded,
+        # once, and leniently so stray non-UTF-8 bytes cannot abort the
+        # final status write.
+        stderr_tmp.seek(0)
+        stderr = stderr_tmp.read().decode("utf-8", errors="replace")
+
     # Phase 3: write final result
-    status = "completed" if result.returncode == 0 else "error"
+    status = "completed" if returncode == 0 else "error"
     final = {
         "status": status,
-        "output": result.stdout,
-        "exit_code": result.returncode,
-        "completed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "output_file": stdout_path,
+        "exit_code": returncode,
+        "completed_at": _utcnow_iso(),
     }
-    if result.stderr:
-        final["error"] = result.stderr
+    if stderr:
+        final["error"] = stderr
     if session_id:
         final["session_id"] = session_id
-    atomic_write_json(output_path, final)
+    atomic_write_json(output_path, final, dir_name=output_dir)
 
     print(output_path)
 